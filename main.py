@@ -1,11 +1,20 @@
 import argparse
 import base64
+import io
 import json
 import os
+import random
 import time
 import logging
+import mmap
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from functools import partial
+from itertools import islice
 from pathlib import Path
-from typing import List
+from typing import Callable, Iterable, Iterator, List, Tuple
+from urllib.parse import quote
 
 import requests
 import re
@@ -13,6 +22,11 @@ from dotenv import load_dotenv
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
+try:
+    import orjson  # Optional: 2-3x faster than stdlib json on the large request bodies
+except ImportError:
+    orjson = None
+
 # Configure logging for urllib3 to show retry messages
 logging.basicConfig(level=logging.INFO)
 logging.getLogger("urllib3").setLevel(logging.INFO)
@@ -41,128 +55,553 @@ INITIAL_PROMPT = (
     "3. your current pose within the map. \n"
     "Continue until I tell you we're finished.\n"
 )
+SYSTEM_PROMPT = "You are a vision language model being used for algorithm-free conceptual SLAM (Simultaneous Localization and Mapping)."
+# Marks the end of the static prompt prefix so providers that support prompt caching (Anthropic,
+# Gemini via OpenRouter) can reuse it instead of re-processing it on every call
+CACHE_CONTROL = {"type": "ephemeral"}
+BATCH_PROMPT = (
+    "Frames {first}-{last} follow, in order. Respond to each frame separately, "
+    "starting each response with a line '### Frame <number>'."
+)
+
+def json_dumps(obj, indent: bool = False) -> bytes:
+    if orjson:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    return json.dumps(obj, indent=2 if indent else None).encode()
+
+def json_loads(data: bytes):
+    # orjson.JSONDecodeError subclasses json.JSONDecodeError, so callers catch either the same way
+    return orjson.loads(data) if orjson else json.loads(data)
+
+_NATKEY_RE = re.compile(r'(\d+)')
+
+def _natkey(path: Path) -> list:
+    """Natural sort key: `frame10.png` sorts after `frame9.png`."""
+    # re.split with a capturing group alternates text/number, so odd indices are always digits
+    return [int(part) if i & 1 else part for i, part in enumerate(_NATKEY_RE.split(path.name))]
+
+IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg"}
+
+def image_mime(path: Path) -> str:
+    return "image/png" if path.suffix.lower() == ".png" else "image/jpeg"
 
 def b64_data_uri(path: Path) -> str:
     """Return a `data:image/png;base64,...` string from a PNG/JPG file."""
-    mime = "image/png" if path.suffix.lower() == ".png" else "image/jpeg"
+    mime = image_mime(path)
     with path.open("rb") as f:
-        b64 = base64.b64encode(f.read()).decode()
+        if os.fstat(f.fileno()).st_size == 0:
+            # mmap can't map an empty file (e.g. a capture that was cut off); send it as-is like before
+            b64 = base64.b64encode(f.read()).decode()
+        else:
+            # Encode straight from the page cache instead of copying the whole file into a bytes object first
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                b64 = base64.b64encode(m).decode()
     return f"data:{mime};base64,{b64}"
 
-# Hoisted session for connection pooling and transport-level retries
-SESSION = requests.Session()
-SESSION.mount("https://", HTTPAdapter(max_retries=Retry(total=3, backoff_factor=0.5))) # Fast retries for transport errors
+# Separate from SESSION so OpenRouter credentials are never sent to the image host
+IMAGE_HOST_SESSION = requests.Session()
+
+def upload_image(path: Path, host: str) -> str:
+    """
+    PUT an image to `host` and return its URL, so requests reference it instead of embedding
+    ~33% larger base64. Falls back to a data URI if the upload fails.
+    """
+    # Percent-encode the name so spaces, '#', '?' etc. can't break the URL the model is given
+    url = f"{host.rstrip('/')}/{quote(path.name)}"
+    try:
+        with path.open("rb") as f:
+            r = IMAGE_HOST_SESSION.put(url, data=f, headers={"Content-Type": image_mime(path)}, timeout=30)
+        r.raise_for_status()
+    except requests.RequestException as e:
+        logging.warning(f"Uploading {path.name} to image host failed ({e}); sending it inline instead")
+        return b64_data_uri(path)
+    return url
+
+PREFETCH_FRAMES = 4
+
+def prefetch(paths: Iterable[Path], encode: Callable[[Path], str], lookahead: int = PREFETCH_FRAMES) -> Iterator[Tuple[Path, str]]:
+    """
+    Yield `(path, encode(path))` in order while up to `lookahead` upcoming frames are encoded on
+    worker threads, so disk reads and base64 work overlap with the request in flight.
+    """
+    pool = ThreadPoolExecutor(max_workers=lookahead)
+    upcoming = iter(paths)
+    pending = deque((path, pool.submit(encode, path)) for path in islice(upcoming, lookahead))
+    try:
+        while pending:
+            path, future = pending.popleft()
+            for nxt in islice(upcoming, 1):
+                pending.append((nxt, pool.submit(encode, nxt)))
+            yield path, future.result()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def live_frames(interval: float, monitor_index: int = 1, region: dict | None = None) -> Iterator[Tuple[str, str]]:
+    """
+    Capture the screen every `interval` seconds and yield `(label, data URI)` pairs, encoding
+    each grab to JPEG in memory instead of round-tripping through a file on disk.
+    """
+    import mss
+    from screenshot_tool import capture_area, save_jpeg
+
+    with mss.mss() as sct:
+        monitor = capture_area(sct, monitor_index, region)
+        next_capture = time.monotonic()
+        while True:
+            # Only wait out what is left of the interval; time spent on the model's reply counts toward it
+            time.sleep(max(0.0, next_capture - time.monotonic()))
+            next_capture = time.monotonic() + interval
+            sct_img = sct.grab(monitor)
+            jpeg = io.BytesIO()
+            save_jpeg(sct_img, jpeg)
+            b64 = base64.b64encode(jpeg.getbuffer()).decode()
+            yield f"live_{int(time.time())}", f"data:image/jpeg;base64,{b64}"
+
+def batched(items: Iterable, size: int) -> Iterator[list]:
+    """Yield successive lists of up to `size` items."""
+    it = iter(items)
+    while batch := list(islice(it, size)):
+        yield batch
+
+_PLACEHOLDER_PREFIX = "[image frame "
+
+def raw_images(message: dict) -> int:
+    return sum(part["type"] == "image_url" for part in message["content"])
+
+def frames_in(message: dict) -> int:
+    """Number of frames a user message covers, whether its images are still raw or already elided."""
+    return sum(
+        part["type"] == "image_url" or part.get("text", "").startswith(_PLACEHOLDER_PREFIX)
+        for part in message["content"]
+    )
+
+def elide_images(message: dict, first_frame: int):
+    """Replace the image parts of an already-answered user message with short text placeholders."""
+    frame_numbers = iter(range(first_frame, first_frame + raw_images(message)))
+    message["content"] = [
+        {"type": "text", "text": f"{_PLACEHOLDER_PREFIX}{next(frame_numbers)} previously shown]"} if part["type"] == "image_url" else part
+        for part in message["content"]
+    ]
+
+def text_only(convo: List[dict]) -> List[dict]:
+    """Copy of `convo` with every raw image replaced by its placeholder; `convo` itself is left untouched."""
+    result, frame = [], 0
+    for msg in convo:
+        if msg["role"] == "user" and isinstance(msg["content"], list):
+            if raw_images(msg):
+                msg = dict(msg)
+                elide_images(msg, frame + 1)
+            frame += frames_in(msg)
+        result.append(msg)
+    return result
 
 RETRYABLE_STATUSES = {500, 502, 503, 504}
+
+# Hoisted session: keeps the TCP+TLS connection to OpenRouter alive across the whole run,
+# and urllib3 retries connect errors and 5xx statuses (POST is not retried by default).
+# Read errors are not retried here: the request may already be generating (and billed)
+# upstream, so those are left to the application-level loop in send_messages.
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=16,
+    max_retries=Retry(
+        total=3,
+        read=False,
+        backoff_factor=0.5,
+        status_forcelist=sorted(RETRYABLE_STATUSES),
+        allowed_methods=frozenset(["POST"]),
+    ),
+))
+
 RETRYABLE_API_CODES = {524, 529} # As identified from prior runs
+RETRYABLE_CLIENT_STATUSES = {408, 429}  # Temporary conditions (timeout, rate limit), unlike other 4xx
+BACKOFF_BASE = 1.0  # seconds before the first application-level retry
+BACKOFF_CAP = 30.0
+BACKOFF_JITTER = 0.5  # up to +50% random spread so concurrent clients don't retry in lockstep
+
+def backoff_delay(attempt: int) -> float:
+    """Capped exponential back-off with multiplicative jitter for the given 1-based attempt."""
+    delay = min(BACKOFF_CAP, BACKOFF_BASE * 2 ** (attempt - 1))
+    return delay * (1 + random.uniform(0, BACKOFF_JITTER))
+
+class RetryableError(RuntimeError):
+    """A temporary failure worth retrying, optionally with the server's requested `retry_after` delay."""
+    def __init__(self, message: str, retry_after: float | None = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def retry_after_seconds(r: requests.Response) -> float | None:
+    """Parse a `Retry-After` header given either as seconds or as an HTTP date."""
+    value = r.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class CircuitOpen(RuntimeError):
+    """Raised instead of calling the API while the circuit breaker is open."""
 
-def send_messages(api_key: str, model: str, messages: List[dict], attempts=5) -> str | None:
+class CircuitBreaker:
+    """
+    Trips after `failure_threshold` consecutive failures and rejects calls until `reset_timeout`
+    has passed, then lets a single half-open probe through. A failed probe re-trips the breaker
+    with the reset timeout doubled (up to `max_reset_timeout`); a successful one closes it.
+    """
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 4.0, max_reset_timeout: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.base_reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def allow(self) -> bool:
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+        return self.state != self.OPEN
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.reset_timeout = self.base_reset_timeout
+
+    def record_failure(self):
+        if self.state == self.HALF_OPEN:
+            self.reset_timeout = min(self.max_reset_timeout, self.reset_timeout * 2)
+            self._trip()
+            return
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            self._trip()
+
+    def _trip(self):
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        logging.error(f"Circuit breaker open; rejecting requests for {self.reset_timeout:.0f}s")
+
+BREAKER = CircuitBreaker()
+
+def rejected(reason: str) -> None:
+    """
+    Handle a request the provider answered but refused. That is not an outage, so it counts as
+    a breaker success, and retrying the same request won't help, so there is no reply.
+    """
+    BREAKER.record_success()
+    logging.error(reason)
+    return None
+
+class RequestTimeouts:
+    """
+    (connect, read) timeouts for OpenRouter calls. The connect timeout is short so DNS/TLS
+    trouble fails fast. The read timeout bounds the silence between streamed chunks: it starts
+    at `read` and, once `min_samples` calls have succeeded, follows max(`read_floor`, 2 * p95)
+    of the longest stall seen in each of the last `window` calls.
+    """
+    def __init__(self, connect: float = 5.0, read: float = 90.0, read_floor: float = 30.0,
+                 min_samples: int = 10, window: int = 50):
+        self.connect = connect
+        self.read = read
+        self.read_floor = read_floor
+        self.min_samples = min_samples
+        self.stalls = deque(maxlen=window)
+
+    def record(self, stall: float):
+        self.stalls.append(stall)
+
+    def current(self) -> Tuple[float, float]:
+        if len(self.stalls) < self.min_samples:
+            return self.connect, self.read
+        ordered = sorted(self.stalls)
+        p95 = ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+        return self.connect, max(self.read_floor, 2 * p95)
+
+TIMEOUTS = RequestTimeouts()
+
+def _sse_events(r: requests.Response) -> Iterator[dict]:
+    """Yield the JSON payload of each `data:` event in an OpenRouter SSE stream, up to `[DONE]`."""
+    for line in r.iter_lines():
+        # Skip blank event separators and ": OPENROUTER PROCESSING" keep-alive comments
+        if not line.startswith(b"data: "):
+            continue
+        payload = line[len(b"data: "):]
+        if payload == b"[DONE]":
+            return
+        yield json_loads(payload)
+    raise RuntimeError("Stream ended before [DONE]")
+
+def send_messages(model: str, messages: List[dict], attempts=5,
+                  on_token: Callable[[str], None] | None = None) -> str | None:
     """
     Sends messages to the OpenRouter API with robust, application-level retry logic.
+    The reply is streamed; each piece of content is passed to `on_token` as it arrives
+    and the full text is returned once the stream completes.
+    Raises `CircuitOpen` without sending anything while the provider is considered down.
     """
+    # Serialize once up front; the body (with its inline images) is identical on every attempt
+    body = json_dumps({"model": model, "messages": messages, "stream": True})
     for i in range(1, attempts + 1):
+        if not BREAKER.allow():
+            raise CircuitOpen("OpenRouter circuit breaker is open; not sending request")
         try:
-            r = SESSION.post(
+            stall = 0.0
+            parts = []
+            with SESSION.post(
                 OPENROUTER_ENDPOINT,
-                headers={
-                    "Authorization": f"Bearer {api_key}",
-                    "Content-Type": "application/json",
-                },
-                json={"model": model, "messages": messages, "stream": False},
-                timeout=30,
-            )
-
-            # Fail fast on non-retryable client errors (4xx)
-            if 400 <= r.status_code < 500:
-                logging.error(f"Client error {r.status_code}: {r.text}")
-                r.raise_for_status() # This will raise an HTTPError to be caught outside
-
-            # Explicitly check for retryable 5xx server errors
-            if r.status_code in RETRYABLE_STATUSES:
-                raise RuntimeError(f"Retryable HTTP {r.status_code} status")
-
-            data = r.json()
-
-            # Check for retryable API provider errors within the JSON response
-            if "error" in data and data.get("error", {}).get("code") in RETRYABLE_API_CODES:
-                raise RuntimeError(f"Retryable provider code {data['error']['code']}")
-            
-            # Check for other API errors and fail fast.
-            if "error" in data:
-                 logging.error(f"Non-retryable API error: {data['error']}")
-                 return None # Or raise a custom non-retryable error
-
-            # Robust message extraction
-            return data["choices"][0]["message"]["content"]
+                data=body,
+                timeout=TIMEOUTS.current(),
+                stream=True,
+            ) as r:
+                # Longest gap between stream events, timed from the response headers so connect time and
+                # urllib3's own retry sleeps don't count; this gap is what the read timeout bounds
+                last_event = time.monotonic()
+
+                # Rate limits and request timeouts are temporary: back off (as long as the server asks) and retry
+                if r.status_code in RETRYABLE_CLIENT_STATUSES:
+                    raise RetryableError(f"Retryable HTTP {r.status_code}", retry_after_seconds(r))
+
+                # Fail fast on non-retryable client errors (4xx)
+                if 400 <= r.status_code < 500:
+                    return rejected(f"Client error {r.status_code}: {r.text}")
+
+                for data in _sse_events(r):
+                    now = time.monotonic()
+                    stall, last_event = max(stall, now - last_event), now
+                    # Check for retryable API provider errors, which can also arrive mid-stream
+                    if "error" in data and data.get("error", {}).get("code") in RETRYABLE_API_CODES:
+                        raise RetryableError(f"Retryable provider code {data['error']['code']}")
+
+                    # Check for other API errors and fail fast.
+                    if "error" in data:
+                        return rejected(f"Non-retryable API error: {data['error']}")
+
+                    # The final usage chunk carries no choices
+                    for choice in data.get("choices", []):
+                        token = choice["delta"].get("content")
+                        if token:
+                            parts.append(token)
+                            if on_token:
+                                on_token(token)
+
+            BREAKER.record_success()
+            TIMEOUTS.record(stall)
+            return "".join(parts)
 
         except (requests.RequestException, RuntimeError, KeyError, ValueError, json.JSONDecodeError) as e:
+            BREAKER.record_failure()
             logging.warning(f"Attempt {i}/{attempts} failed: {e}")
             if i == attempts:
                 logging.error(f"All {attempts} attempts failed. Last error: {e}")
                 return None # Return None after all retries are exhausted
-            time.sleep(2 ** i * 0.5)  # Exponential back-off
+            if parts and on_token:
+                on_token("\n[retrying]\n") # Separate the partial reply from the one streamed next
+            delay = backoff_delay(i)
+            if isinstance(e, RetryableError) and e.retry_after is not None:
+                delay = max(delay, e.retry_after)
+            time.sleep(delay)
+
+def print_token(token: str):
+    print(token, end="", flush=True)
+
+def write_transcript(path: str, convo: List[dict]):
+    """Atomically replace the JSON transcript at `path`, so a crash mid-write never loses earlier frames."""
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(json_dumps(convo, indent=True))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def load_transcript(path: str) -> List[dict]:
+    """Load a transcript to resume, dropping any bird's-eye exchange or unanswered frame at the end."""
+    with open(path, "rb") as f:
+        convo = json_loads(f.read())
+    while len(convo) > 1 and not (convo[-1]["role"] == "assistant" and isinstance(convo[-2]["content"], list)):
+        convo.pop()
+    return convo
 
 def main():
     p = argparse.ArgumentParser(description="Stream images to a VLM for SLAM test")
-    p.add_argument("--dir", required=True, help="directory of images, ordered by name")
+    source = p.add_mutually_exclusive_group(required=True)
+    source.add_argument("--dir", help="directory of images, ordered by name")
+    source.add_argument("--live", type=float, metavar="INTERVAL",
+                        help="capture the screen every INTERVAL seconds instead of reading --dir; Ctrl+C to finish")
+    p.add_argument("--monitor", type=int, help="with --live: monitor to capture (default 1 = first physical monitor, 0 = all)")
+    p.add_argument("--region", help="with --live: capture only x,y,w,h instead of a whole monitor")
     p.add_argument("--model", default="google/gemini-2.5-flash-preview-05-20", help="OpenRouter model id")
-    p.add_argument("--out", help="write JSON transcript here")
+    p.add_argument("--out", help="write JSON transcript here (rewritten after every frame)")
+    p.add_argument("--resume", action="store_true", help="continue from the transcript in --out, skipping frames it already covers")
+    p.add_argument("--connect-timeout", type=float, default=TIMEOUTS.connect, help="seconds to wait for the connection to OpenRouter")
+    p.add_argument("--read-timeout", type=float,
+                   help=f"max seconds of silence while streaming a reply (default {TIMEOUTS.read:g}, then 2x observed p95 "
+                        f"after 10 replies); an explicit value is never adapted below")
+    p.add_argument("--batch-size", type=int, default=1, help="frames sent per request")
+    p.add_argument("--image-window", type=int, default=3,
+                   help="max raw images per request; older frames are replaced by a text placeholder")
+    p.add_argument("--image-host", help="base URL that accepts HTTP PUT uploads and serves them publicly; "
+                                        "images are sent by URL instead of inline base64")
     args = p.parse_args()
+    if args.connect_timeout <= 0 or (args.read_timeout is not None and args.read_timeout <= 0):
+        p.error("timeouts must be positive")
+    TIMEOUTS.connect = args.connect_timeout
+    if args.read_timeout is not None:
+        # Adaptation may still raise the timeout, but never below what the user asked for
+        TIMEOUTS.read = TIMEOUTS.read_floor = args.read_timeout
+    if args.batch_size < 1:
+        p.error("--batch-size must be at least 1")
+    if args.image_window < 1:
+        p.error("--image-window must be at least 1")
+    if args.batch_size > args.image_window:
+        p.error("--batch-size cannot exceed --image-window")
+    if args.live is not None and args.live <= 0:
+        p.error("--live interval must be positive")
+    if args.live and args.image_host:
+        p.error("--image-host only applies to --dir frames")
+    if not args.live and (args.monitor is not None or args.region):
+        p.error("--monitor and --region only apply to --live capture")
+    if args.resume and not args.out:
+        p.error("--resume requires --out")
 
     load_dotenv(override=True) # Load environment variables from .env file
     api_key = os.getenv("OPENROUTER_API_KEY")
     if not api_key:
         raise RuntimeError("Set OPENROUTER_API_KEY in env")
+    # Set once for the whole run rather than rebuilt on every request
+    SESSION.headers.update({"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"})
+
+    if args.resume and os.path.exists(args.out):
+        convo = load_transcript(args.out)
+    else:
+        convo = [
+            {"role": "system", "content": [{"type": "text", "text": SYSTEM_PROMPT, "cache_control": CACHE_CONTROL}]}
+        ]
 
-    frames = sorted(Path(args.dir).glob("*.[pj][np]g"), key=lambda path: [int(c) if c.isdigit() else c for c in re.split(r'(\d+)', path.name)])
-    if not frames:
-        raise RuntimeError("No .png/.jpg images found in directory")
+    # Count frames already answered, and track the ones that still carry their raw image (oldest first)
+    done = 0
+    shown = deque()
+    for msg in convo:
+        if msg["role"] == "user" and isinstance(msg["content"], list):
+            if raw_images(msg):
+                shown.append((msg, done + 1))
+            done += frames_in(msg)
+    # A resumed transcript may have been written with a larger window or smaller batch
+    while shown and sum(raw_images(msg) for msg, _ in shown) + args.batch_size > args.image_window:
+        elide_images(*shown.popleft())
+    if done:
+        print(f"Resuming after {done} frames from {args.out}")
 
-    convo = [
-        {"role": "system", "content": "You are a vision language model being used for algorithm-free conceptual SLAM (Simultaneous Localization and Mapping)."}
-    ]
+    if args.live:
+        import mss
+        from screenshot_tool import capture_area, parse_region
+        try:
+            region = parse_region(args.region) if args.region else None
+        except ValueError as e:
+            p.error(f"--region must be x,y,w,h ({e})")
+        monitor = 1 if args.monitor is None else args.monitor
+        # Validate the monitor now rather than on the generator's first capture
+        with mss.mss() as sct:
+            try:
+                capture_area(sct, monitor, region)
+            except ValueError as e:
+                p.error(str(e))
+        frame_source = live_frames(args.live, monitor, region)
+    else:
+        if not Path(args.dir).is_dir():
+            p.error(f"--dir {args.dir} is not a directory")
+        frames = sorted(
+            (path for path in Path(args.dir).iterdir() if path.suffix.lower() in IMAGE_SUFFIXES and path.is_file()),
+            key=_natkey,
+        )
+        if not frames:
+            raise RuntimeError("No .png/.jpg/.jpeg images found in directory")
+        frames = frames[done:]
+        encode = partial(upload_image, host=args.image_host) if args.image_host else b64_data_uri
+        frame_source = ((path.name, uri) for path, uri in prefetch(frames, encode))
 
     print("Prompt sent. Waiting for model's mapping responses...\n")
 
-    for idx, img_path in enumerate(frames, 1):
-        # For the first image, include the initial prompt text along with the image
-        if idx == 1:
-            user_content = [
-                {"type": "text", "text": INITIAL_PROMPT},
-                {"type": "image_url", "image_url": {"url": b64_data_uri(img_path)}}
-            ]
-        else:
-            # For subsequent images, just send the image
-            user_content = [{"type": "image_url", "image_url": {"url": b64_data_uri(img_path)}}]
+    try:
+        first = done + 1
+        for batch in batched(frame_source, args.batch_size):
+            last = first + len(batch) - 1
+            if len(batch) == 1:
+                label = f"Frame {first}: {batch[0][0]}"
+            else:
+                label = f"Frames {first}-{last}: {batch[0][0]} .. {batch[-1][0]}"
+
+            user_content = []
+            # For the first image, include the initial prompt text along with the image
+            if first == 1:
+                user_content.append({"type": "text", "text": INITIAL_PROMPT, "cache_control": CACHE_CONTROL})
+            if len(batch) > 1:
+                user_content.append({"type": "text", "text": BATCH_PROMPT.format(first=first, last=last)})
+            user_content += [{"type": "image_url", "image_url": {"url": image_uri}} for _, image_uri in batch]
 
-        convo.append({"role": "user", "content": user_content})
-        reply = send_messages(api_key, args.model, convo)
-        if not reply:
-            print(f"\nFailed to get a response for frame {idx} ({img_path.name}). Halting.")
-            break
-        # Append assistant response to full transcript
-        convo.append({"role": "assistant", "content": reply})
+            user_msg = {"role": "user", "content": user_content}
+            convo.append(user_msg)
+            print(f"--- {label} ---")
+            try:
+                reply = send_messages(args.model, convo, on_token=print_token)
+            except CircuitOpen as e:
+                print(f"\n{e}; skipping remaining frames from {label}. Halting.")
+                break
+            if not reply:
+                print(f"\nFailed to get a response for {label}. Halting.")
+                break
+            # Append assistant response to full transcript
+            convo.append({"role": "assistant", "content": reply})
+            # The reply already describes this frame in text, so only the most recent images are
+            # re-sent; this keeps each request O(window) instead of growing with the whole history
+            shown.append((user_msg, first))
+            # Leave room for the next batch so no request carries more than --image-window raw images
+            while shown and sum(raw_images(msg) for msg, _ in shown) + args.batch_size > args.image_window:
+                elide_images(*shown.popleft())
+            if args.out:
+                write_transcript(args.out, convo)
 
-        print(f"--- Frame {idx}: {img_path.name} ---\n{reply}\n")
-        # Rate limiting logic is now implicitly handled by the retry backoff
+            print("\n")
+            first = last + 1
+            # Rate limiting logic is now implicitly handled by the retry backoff
+    except KeyboardInterrupt:
+        if not args.live:
+            raise
+        if convo[-1]["role"] == "user":
+            convo.pop() # Drop the frame whose reply was interrupted
+        print("\nLive capture stopped.")
+    finally:
+        frame_source.close()
 
     # After all images are processed, ask the model for a bird's eye view plot
     BIRDS_EYE_VIEW_PROMPT = "Now that you have processed all images, please provide a comprehensive birds-eye view map of the entire environment you explored, clearly indicating the path taken, key landmarks, and your final localized position. Represent this map in a way that is easy to visualize as a plot."
-    # For the final bird's eye view prompt, send the full current conversation history
-    # as context, so the model has all the information to summarize.
-    convo.append({"role": "user", "content": BIRDS_EYE_VIEW_PROMPT})
-    birds_eye_reply = send_messages(api_key, args.model, convo)
+    # The assistant replies already hold the map as text, so the summary request carries the
+    # conversation without any images: KB-sized instead of MB-sized, and focused on summarizing.
+    birds_eye_msg = {"role": "user", "content": BIRDS_EYE_VIEW_PROMPT}
+    summary_convo = text_only(convo) + [birds_eye_msg]
+    convo.append(birds_eye_msg)
+    print("\n--- Bird's Eye View Map ---\n")
+    try:
+        birds_eye_reply = send_messages(args.model, summary_convo, on_token=print_token)
+    except CircuitOpen as e:
+        logging.error(str(e))
+        birds_eye_reply = None
 
     if birds_eye_reply:
         convo.append({"role": "assistant", "content": birds_eye_reply}) # Append this final reply to the transcript
-        print("\n--- Bird's Eye View Map ---\n")
-        print(birds_eye_reply)
+        print()
     else:
         print("\n--- Failed to get Bird's Eye View Map ---\n")
 
     if args.out:
-        with open(args.out, "w") as f:
-            json.dump(convo, f, indent=2)
+        write_transcript(args.out, convo)
         print(f"Full transcript written to {args.out}")
 
 if __name__ == "__main__":
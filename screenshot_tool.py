@@ -1,18 +1,71 @@
+import argparse
 import mss
-import mss.tools
 from PIL import Image
+import queue
+import threading
 import time
 import sys
 import os
 
-def start_screenshot_capture(interval_seconds: int, output_dir: str):
+MAX_SIDE = 1280  # VLMs downscale to roughly this internally, so larger frames are wasted bytes
+JPEG_QUALITY = 85
+ENCODE_QUEUE_SIZE = 4  # captures waiting to be encoded before new ones are dropped
+
+def save_jpeg(sct_img, output):
+    """
+    Downscales an mss screenshot to fit within MAX_SIDE pixels and saves it as JPEG.
+
+    Args:
+        sct_img: The screenshot returned by `mss.mss().grab`.
+        output: A filename or a writable binary file object.
+    """
+    # Decode mss's native BGRA buffer directly instead of going through its `.rgb` copy
+    img = Image.frombytes("RGB", sct_img.size, sct_img.bgra, "raw", "BGRX")
+    # reducing_gap does a fast integer box reduction before the LANCZOS pass
+    img.thumbnail((MAX_SIDE, MAX_SIDE), Image.LANCZOS, reducing_gap=2.0)
+    # Pillow's JPEG encoder is libjpeg-turbo (SIMD DCT); skip `optimize`, its extra Huffman pass costs more than it saves here
+    img.save(output, "JPEG", quality=JPEG_QUALITY)
+
+def parse_region(text: str) -> dict:
     """
-    Captures screenshots of the primary monitor at a specified interval and saves them
-    to the given output directory.
+    Parses an `x,y,w,h` string into an mss capture area.
+
+    Args:
+        text (str): Left, top, width and height in virtual-screen pixels.
+    """
+    x, y, w, h = (int(v) for v in text.split(","))
+    if w <= 0 or h <= 0:
+        raise ValueError("Region width and height must be positive.")
+    return {"left": x, "top": y, "width": w, "height": h}
+
+def capture_area(sct, monitor_index: int = 1, region: dict | None = None) -> dict:
+    """
+    Picks what to grab: an explicit region if given, otherwise a single physical monitor.
+
+    `sct.monitors[0]` is the bounding box of *all* monitors, so on multi-display setups it
+    captures (and encodes, and uploads) mostly unused pixels; real monitors start at index 1.
+
+    Args:
+        sct: An `mss.mss()` instance.
+        monitor_index (int): Index into `sct.monitors`; 1 is the first physical monitor.
+        region (dict | None): An area from `parse_region`, which takes precedence over the monitor.
+    """
+    if region:
+        return region
+    if not 0 <= monitor_index < len(sct.monitors):
+        raise ValueError(f"Monitor {monitor_index} not found; {len(sct.monitors) - 1} monitor(s) available.")
+    return sct.monitors[monitor_index]
+
+def start_screenshot_capture(interval_seconds: int, output_dir: str, monitor_index: int = 1, region: dict | None = None):
+    """
+    Captures screenshots of a monitor (or a region of the screen) at a specified interval and
+    saves them to the given output directory as downscaled JPEGs.
 
     Args:
         interval_seconds (int): The interval in seconds between screenshots.
         output_dir (str): The directory where screenshots will be saved.
+        monitor_index (int): Which monitor to capture; 1 is the first physical monitor.
+        region (dict | None): Capture only this area (see `parse_region`) instead of a whole monitor.
     """
     if not isinstance(interval_seconds, int) or interval_seconds <= 0:
         raise ValueError("Interval must be a positive integer.")
@@ -20,7 +73,22 @@ def start_screenshot_capture(interval_seconds: int, output_dir: str):
     os.makedirs(output_dir, exist_ok=True) # Create output directory if it doesn't exist
 
     sct = mss.mss()
-    monitor = sct.monitors[0]  # Capture the primary monitor
+    monitor = capture_area(sct, monitor_index, region)
+
+    # Encoding runs on a background thread so it never delays the next capture
+    pending = queue.Queue(maxsize=ENCODE_QUEUE_SIZE)
+
+    def encode_worker():
+        while (item := pending.get()) is not None:
+            sct_img, filename = item
+            try:
+                save_jpeg(sct_img, filename)
+                print(f"Screenshot saved: {filename}")
+            except Exception as e:
+                print(f"Failed to save {filename}: {e}")
+
+    encoder = threading.Thread(target=encode_worker, daemon=True)
+    encoder.start()
 
     print(f"Starting screenshot capture every {interval_seconds} seconds. Screenshots will be saved to '{output_dir}'. Press Ctrl+C to stop.")
 
@@ -31,27 +99,33 @@ def start_screenshot_capture(interval_seconds: int, output_dir: str):
             
             # Define filename with timestamp
             timestamp = int(time.time())
-            filename = os.path.join(output_dir, f"screenshot_{timestamp}.png")
-
-            # Save to the specified directory
-            mss.tools.to_png(sct_img.rgb, sct_img.size, output=filename)
+            filename = os.path.join(output_dir, f"screenshot_{timestamp}.jpg")
 
-            print(f"Screenshot saved: {filename}")
+            # Hand off to the encoder; drop the frame rather than stall capture if it falls behind
+            try:
+                pending.put_nowait((sct_img, filename))
+            except queue.Full:
+                print(f"Encoder is behind; dropped {filename}")
 
             time.sleep(interval_seconds)
     except KeyboardInterrupt:
         print("\nScreenshot capture stopped.")
     except Exception as e:
         print(f"An error occurred: {e}")
+    finally:
+        # Let the encoder finish what is already queued
+        pending.put(None)
+        encoder.join()
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python screenshot_tool.py <interval_seconds> <output_directory>")
-        sys.exit(1)
+    p = argparse.ArgumentParser(description="Periodically capture screenshots for a VLM-SLAM run")
+    p.add_argument("interval_seconds", type=int, help="seconds between screenshots")
+    p.add_argument("output_directory", help="where screenshots are saved")
+    p.add_argument("--monitor", type=int, default=1, help="monitor to capture (1 = first physical monitor, 0 = all monitors)")
+    p.add_argument("--region", type=parse_region, help="capture only x,y,w,h instead of a whole monitor")
+    args = p.parse_args()
     try:
-        capture_interval = int(sys.argv[1])
-        output_directory = sys.argv[2]
-        start_screenshot_capture(capture_interval, output_directory)
-    except ValueError: # Catch for capture_interval
-        print("Error: Interval must be a positive integer.")
-        sys.exit(1)
\ No newline at end of file
+        start_screenshot_capture(args.interval_seconds, args.output_directory, args.monitor, args.region)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)